@@ -90,6 +90,7 @@ setup(
     scripts=glob.glob('scripts/*'),
     zip_safe=False,
     install_requires=install_requires,
+    extras_require=dict(isal=['isal']),
     platforms=['MacOS X', 'Posix'],
     test_suite='test',
     cmdclass=dict(install=Install,
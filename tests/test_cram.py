@@ -1,14 +1,21 @@
 #!/usr/bin/env python
 import io
 import os
+import base64
+import errno
 import sys
 import unittest
+import unittest.mock
 import subprocess
 import logging
 
 from uuid import uuid4
+from types import SimpleNamespace
+from tempfile import TemporaryDirectory
 from typing import List
 
+import google_crc32c
+
 pkg_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))  # noqa
 sys.path.insert(0, pkg_root)  # noqa
 
@@ -225,7 +232,171 @@ class TestCram(SuppressWarningsMixin, unittest.TestCase):
             self.run_cram_view_api_with_regions(self.cram_gs_path, self.crai_gs_path)
 
     def test_read_crai(self):
-        self.assertEqual(len(cram.get_crai_indices(self.crai_local_path)), 5)
+        crai_indices = cram.get_crai_indices(self.crai_local_path)
+        self.assertEqual(len(crai_indices), 5)
+        self.assertEqual(crai_indices[0], cram.CramLocation(chr=0, alignment_start=2, alignment_span=101,
+                                                            offset=10039, slice_offset=319, slice_size=241))
+        self.assertEqual(cram.get_crai_indices(f'file://{self.crai_local_path}'), crai_indices)
+        with open(self.crai_local_path, 'rb') as fh:
+            crai_bytes = fh.read()
+        self.assertEqual(cram.get_crai_indices(crai_bytes), crai_indices)
+        self.assertEqual(cram.get_crai_indices_from_bytes(crai_bytes), crai_indices)
+        with unittest.mock.patch.object(cram.gs_utils, '_blob_for_url', return_value=None):
+            with self.assertRaises(FileNotFoundError):
+                cram.get_crai_indices('gs://bucket/missing.crai')
+        # repeated reads of an unchanged local index come from the cache, but never share a mutable list
+        self.assertIsNot(cram.get_crai_indices(self.crai_local_path), crai_indices)
+        self.assertEqual(cram.get_crai_indices(self.crai_local_path), crai_indices)
+
+    def test_stage_gs_cache(self):
+        contents = b'cram contents'
+        downloads = []
+
+        def fake_download(gs_path, output_filename=None, blob=None):
+            downloads.append(gs_path)
+            with open(output_filename, 'wb') as fh:
+                fh.write(contents)
+            return output_filename
+
+        checksum = google_crc32c.Checksum()
+        checksum.update(contents)
+        crc32c = base64.b64encode(checksum.digest()).decode('utf-8')
+
+        def fake_blob(generation):
+            return SimpleNamespace(bucket=SimpleNamespace(name='bucket'), name='key', generation=generation,
+                                   size=len(contents), crc32c=crc32c)
+
+        uri = 'gs://bucket/key'
+        with TemporaryDirectory() as cache_dir, TemporaryDirectory() as staging_dir, \
+                unittest.mock.patch.dict(os.environ, {'XSAMTOOLS_CACHE': cache_dir}), \
+                unittest.mock.patch.object(cram, 'download_full_gs', side_effect=fake_download), \
+                unittest.mock.patch.object(cram.gs_utils, '_blob_for_url', return_value=fake_blob(1)) as blob_for_url:
+            with self.subTest('A cache miss downloads and moves the object into the cache.'):
+                cram.stage(uri, os.path.join(staging_dir, 'miss.cram'))
+                self.assertEqual(downloads, [uri])
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+                self.assertFalse([f for f in os.listdir(cache_dir) if f.endswith('.partial')])
+                with open(os.path.join(staging_dir, 'miss.cram'), 'rb') as fh:
+                    self.assertEqual(fh.read(), contents)
+
+            with self.subTest('A cache hit links the cached copy without downloading.'):
+                cram.stage(uri, os.path.join(staging_dir, 'hit.cram'))
+                self.assertEqual(downloads, [uri])
+                with open(os.path.join(staging_dir, 'hit.cram'), 'rb') as fh:
+                    self.assertEqual(fh.read(), contents)
+
+            with self.subTest('A new generation of the object is a cache miss.'):
+                blob_for_url.return_value = fake_blob(2)
+                cram.stage(uri, os.path.join(staging_dir, 'new_generation.cram'))
+                self.assertEqual(downloads, [uri, uri])
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            def interrupted_download(gs_path, output_filename=None, blob=None):
+                with open(output_filename, 'wb') as fh:
+                    fh.write(contents[:4])
+                raise OSError('connection reset')
+
+            with self.subTest('A failed download leaves no partial file in the cache.'):
+                blob_for_url.return_value = fake_blob(3)
+                with unittest.mock.patch.object(cram, 'download_full_gs', side_effect=interrupted_download):
+                    with self.assertRaises(OSError):
+                        cram.stage(uri, os.path.join(staging_dir, 'failed.cram'))
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+            def corrupted_download(gs_path, output_filename=None, blob=None):
+                with open(output_filename, 'wb') as fh:
+                    fh.write(contents[::-1])
+                return output_filename
+
+            with self.subTest('A download that fails its CRC32C check is not cached.'):
+                blob_for_url.return_value = fake_blob(4)
+                with unittest.mock.patch.object(cram, 'download_full_gs', side_effect=corrupted_download):
+                    with self.assertRaises(ValueError):
+                        cram.stage(uri, os.path.join(staging_dir, 'corrupted.cram'))
+                self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+    def test_download_full_gs_verifies_crc32c(self):
+        contents = os.urandom(1024 * 1024)
+        checksum = google_crc32c.Checksum()
+        checksum.update(contents)
+        crc32c = base64.b64encode(checksum.digest()).decode('utf-8')
+
+        class FakeReader(io.BytesIO):
+            chunk_size = 64 * 1024
+
+        def fake_reader(blob, async_queue=None):
+            return FakeReader(contents)
+
+        with TemporaryDirectory() as staging_dir, \
+                unittest.mock.patch.object(cram, '_PARALLEL_DOWNLOAD_THRESHOLD', 0), \
+                unittest.mock.patch.object(cram.gscio, 'Reader', side_effect=fake_reader):
+            output = os.path.join(staging_dir, 'out.cram')
+            with self.subTest('A chunked download with a matching CRC32C is kept.'):
+                blob = SimpleNamespace(name='key', size=len(contents), crc32c=crc32c)
+                cram.download_full_gs('gs://bucket/key', output_filename=output, blob=blob)
+                with open(output, 'rb') as fh:
+                    self.assertEqual(fh.read(), contents)
+
+            with self.subTest('A chunked download with a mismatched CRC32C raises and is removed.'):
+                blob = SimpleNamespace(name='key', size=len(contents), crc32c='AAAAAA==')
+                with self.assertRaises(ValueError):
+                    cram.download_full_gs('gs://bucket/key', output_filename=output, blob=blob)
+                self.assertFalse(os.path.exists(output))
+
+    def test_write_final_file_with_samtools_args(self):
+        stderr = b'[main_samview] region "CHROMOSOME_VI" specifies an unknown reference name. Continue anyway.\n'
+        completed = subprocess.CompletedProcess(args=[], returncode=0, stdout=None, stderr=stderr)
+        with unittest.mock.patch.object(cram, 'run', return_value=completed) as run:
+            with self.assertLogs(cram.log, level='WARNING') as logs:
+                cram.write_final_file_with_samtools(cram='/tmp/input dir/in.cram',
+                                                    crai='/tmp/input dir/in.crai',
+                                                    regions=' CHROMOSOME_I , ,CHROMOSOME_VI:1-100,',
+                                                    cram_format=True,
+                                                    output='/tmp/output dir/out.cram')
+        cmd = run.call_args[0][0]
+        self.assertEqual(cmd, ['samtools', 'view', '--threads', str(cram.cores_available),
+                               '-o', '/tmp/output dir/out.cram', '-C', '/tmp/input dir/in.cram',
+                               '-X', '/tmp/input dir/in.crai', 'CHROMOSOME_I', 'CHROMOSOME_VI:1-100'])
+        self.assertEqual(run.call_args[1]['stderr'], subprocess.PIPE)
+        self.assertTrue(any('unknown reference name' in line for line in logs.output))
+
+        with self.subTest('SAM output without regions or an index passes neither -C nor -X.'):
+            completed = subprocess.CompletedProcess(args=[], returncode=0, stdout=None, stderr=b'')
+            with unittest.mock.patch.object(cram, 'run', return_value=completed) as run:
+                cram.write_final_file_with_samtools('in.cram', None, None, False, 'out.sam')
+            self.assertEqual(run.call_args[0][0], ['samtools', 'view', '--threads', str(cram.cores_available),
+                                                   '-o', 'out.sam', 'in.cram'])
+
+    def test_stage_local_link_fallback(self):
+        contents = os.urandom(1024 * 1024)
+        with TemporaryDirectory() as staging_dir:
+            src = os.path.join(staging_dir, 'src.cram')
+            with open(src, 'wb') as fh:
+                fh.write(contents)
+
+            with self.subTest('A link across filesystems falls back to copying.'):
+                dst = os.path.join(staging_dir, 'exdev.cram')
+                with unittest.mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')):
+                    cram.stage(src, dst)
+                with open(dst, 'rb') as fh:
+                    self.assertEqual(fh.read(), contents)
+
+            with self.subTest('Without reflink support the copy falls back to copyfile, leaving a full copy.'):
+                dst = os.path.join(staging_dir, 'no_reflink.cram')
+                with unittest.mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')), \
+                        unittest.mock.patch('fcntl.ioctl', side_effect=OSError(errno.EOPNOTSUPP, 'Not supported')) \
+                        as ioctl:
+                    cram.stage(src, dst)
+                ioctl.assert_called_once()
+                with open(dst, 'rb') as fh:
+                    self.assertEqual(fh.read(), contents)
+
+            with self.subTest('Other link errors propagate.'):
+                dst = os.path.join(staging_dir, 'enoent.cram')
+                with unittest.mock.patch('os.link', side_effect=OSError(errno.ENOENT, 'No such file or directory')):
+                    with self.assertRaises(FileNotFoundError):
+                        cram.stage(src, dst)
+                self.assertFalse(os.path.exists(dst))
 
     def test_decode_itf8_array(self):
         number_of_items_in_the_array = b'\x04'
@@ -242,6 +413,13 @@ class TestCram(SuppressWarningsMixin, unittest.TestCase):
             results = cram.decode_itf8_array(itf8_array_input_stream, size=4)
             self.assertEqual(results, [1, 128, 268435456, 2 ** 32 - 1])
 
+        with self.subTest('Test decoding an itf8 array leaves the stream positioned just past the array.'):
+            trailing_bytes = b'\x02\x03'
+            itf8_array_input_stream = io.BytesIO(number_of_items_in_the_array + array_items + trailing_bytes)
+            results = cram.decode_itf8_array(itf8_array_input_stream)
+            self.assertEqual(results, [1, 128, 268435456, 2 ** 32 - 1])
+            self.assertEqual(itf8_array_input_stream.read(), trailing_bytes)
+
     def test_encode_decode_itf8(self):
         """
         Tests ITF-8 encoding and decoding functions.
@@ -7,28 +7,32 @@ from xsamtools.cli.cram import view
 from xsamtools.cli.vcf import merge, subsample, stats
 
 
+_CRAM_VIEW_ARGS = {
+    "--cram": dict(type=str, required=True,
+                   help="Input cram file. This can be a Google Storage object if prefixed with 'gs://'."),
+    "--crai": dict(type=str, required=False,
+                   help="Input crai file. This can be a Google Storage file (e.g. gs://bucket/key) or a local file. "
+                        "If not specified, one will be generated for you (this may take a long time)."),
+    # TODO: add an argument to intake a BED file.
+    "--regions": dict(type=str, required=False, default=None,
+                      help="A comma-delimited list of regions of sequence in the input cram file to subset as the "
+                           "output CRAM.  For example, something like: 'ch1,ch2' or 'chromsome_1:10000,chromosome2'."),
+    "-C": dict(action='store_true', required=False,
+               help="Write the output file in CRAM format."),
+    # TODO: Allow this to be a google key.
+    "--output": dict(type=str, required=False, default=None,
+                     help="A local output file path for the generated cram file."),
+}
+
+
 def add_cram_subparser(subparsers):
     cram_parser = subparsers.add_parser('cram')
     # The api here is somewhat redundant, cram only has a single sub-command/parser
     cram_subparsers = cram_parser.add_subparsers()
     view_parser = cram_subparsers.add_parser('view', description='A limited wrapper around "samtools view", but with '
                                                                  'functions to operate on google cloud bucket keys.')
-    view_parser.add_argument("--cram", type=str, required=True,
-                             help="Input cram file. This can be a Google Storage object if prefixed with 'gs://'.")
-    view_parser.add_argument("--crai", type=str, required=False,
-                             help="Input crai file. This can be a Google Storage file (e.g. gs://bucket/key) or a "
-                                  "local file. If not specified, one will be generated for you (this may take a long "
-                                  "time).")
-    # TODO: add an argument to intake a BED file.
-    view_parser.add_argument("--regions", type=str, required=False, default=None,
-                             help="A comma-delimited list of regions of sequence in the input cram file to subset as "
-                                  "the output CRAM.  For example, something like: 'ch1,ch2' or "
-                                  "'chromsome_1:10000,chromosome2'.")
-    view_parser.add_argument("-C", action='store_true', required=False,
-                             help="Write the output file in CRAM format.")
-    # TODO: Allow this to be a google key.
-    view_parser.add_argument("--output", type=str, required=False, default=None,
-                             help="A local output file path for the generated cram file.")
+    for name, kwargs in _CRAM_VIEW_ARGS.items():
+        view_parser.add_argument(name, **kwargs)
     view_parser.set_defaults(func=view)
 
 
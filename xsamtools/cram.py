@@ -5,22 +5,95 @@ CRAM/CRAI spec here:
 http://samtools.github.io/hts-specs/CRAMv3.pdf
 """
 import os
+import base64
 import datetime
+import errno
+import fcntl
+import hashlib
 import logging
-import gzip
 import io
+import stat
+import struct
+import subprocess
 
 from collections import namedtuple
+from functools import lru_cache
+from multiprocessing import cpu_count
 from tempfile import TemporaryDirectory
-from typing import Optional, Dict, Any, Union
-from urllib.request import urlretrieve
+from typing import Optional, Dict, Any, List, Tuple, Union
+from shutil import copyfile, copyfileobj
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from urllib.request import urlopen
+import google_crc32c
+import gs_chunked_io as gscio
+from gs_chunked_io import async_collections
 from terra_notebook_utils import xprofile
+try:
+    # python-isal's igzip is a faster, drop-in replacement for the standard library gzip module
+    from isal import igzip as gzip
+except ImportError:
+    import gzip  # type: ignore
 
-from xsamtools import gs_utils
+from xsamtools import gs_utils, pipes
 from xsamtools.utils import run
 
 CramLocation = namedtuple("CramLocation", "chr alignment_start alignment_span offset slice_offset slice_size")
 log = logging.getLogger(__name__)
+cores_available = cpu_count()
+
+# Total number of bytes used by an ITF-8/LTF-8 encoded integer, indexed by the value of its first byte.
+_ITF8_LENGTH = bytes([1] * 128 + [2] * 64 + [3] * 32 + [4] * 16 + [5] * 16)
+_LTF8_LENGTH = bytes([1] * 128 + [2] * 64 + [3] * 32 + [4] * 16 + [5] * 8 + [6] * 4 + [7] * 2 + [8] + [9])
+# Mask for the value bits carried by the first byte, indexed by the total number of encoded bytes.
+_ITF8_MASK = (0, 0x7F, 0x3F, 0x1F, 0x0F, 0x0F)
+_LTF8_MASK = (0, 0x7F, 0x3F, 0x1F, 0x0F, 0x07, 0x03, 0x01, 0x00, 0x00)
+# Indexed by the first byte of an encoded value: the total number of encoded bytes, and the value bits carried by the
+# first byte already shifted into place. A 5 byte ITF-8 only takes 4 bits from its last byte, hence its shift of 28.
+_ITF8_LEADING_BYTE = tuple((length, (int1 & _ITF8_MASK[length]) << (28 if length == 5 else 8 * (length - 1)))
+                           for int1, length in enumerate(_ITF8_LENGTH))
+_LTF8_LEADING_BYTE = tuple((length, (int1 & _LTF8_MASK[length]) << (8 * (length - 1)))
+                           for int1, length in enumerate(_LTF8_LENGTH))
+# Indexed by num.bit_length(): the number of bytes used to encode num, and its length prefix shifted into place.
+_ITF8_PREFIX = (0, 0x00, 0x80, 0xC0, 0xE0, 0xF0)
+_LTF8_PREFIX = (0, 0x00, 0x80, 0xC0, 0xE0, 0xF0, 0xF8, 0xFC, 0xFE, 0xFF)
+_ITF8_ENCODING = tuple((length, _ITF8_PREFIX[length] << (8 * (length - 1)))
+                       for length in [1] * 8 + [2] * 7 + [3] * 7 + [4] * 7 + [5] * 4)
+_LTF8_ENCODING = tuple((length, _LTF8_PREFIX[length] << (8 * (length - 1)))
+                       for length in [1] * 8 + [2] * 7 + [3] * 7 + [4] * 7 + [5] * 7 + [6] * 7 + [7] * 7 + [8] * 7
+                       + [9] * 8)
+# Upper bound on the bytes a container header occupies before its landmarks: INT32, 5 ITF-8s, 2 LTF-8s, and the ITF-8
+# landmark count.
+_CONTAINER_HEADER_MAX_PREFIX_SIZE = 4 + 5 * 5 + 2 * 9 + 5
+_INT32 = struct.Struct('<i')
+
+# Values below 128 encode to themselves in a single byte and are by far the most common, so they skip the general path.
+# A table covering two-byte values too would cost several hundred KB of bytes objects for a small further gain.
+_ITF8_ONE_BYTE = tuple(bytes((i,)) for i in range(128))
+
+# Variable-length fields of a container header between the length and the landmarks, in file order.
+_CONTAINER_HEADER_VARINT_FIELDS = (
+    ("reference_sequence_id", _ITF8_LEADING_BYTE),
+    ("starting_position", _ITF8_LEADING_BYTE),
+    ("alignment_span", _ITF8_LEADING_BYTE),
+    ("number_of_records", _ITF8_LEADING_BYTE),
+    ("record_counter", _LTF8_LEADING_BYTE),
+    ("bases", _LTF8_LEADING_BYTE),
+    ("number_of_blocks", _ITF8_LEADING_BYTE),
+    ("number_of_landmarks", _ITF8_LEADING_BYTE),
+)
+# Copy buffer size used when staging remote files locally.
+_STAGE_BUFFER_SIZE = 256 * 1024
+
+# Blobs smaller than this are downloaded in a single request; parallelism does not pay for itself below a few chunks.
+_PARALLEL_DOWNLOAD_THRESHOLD = 64 * 1024 * 1024
+_PARALLEL_DOWNLOAD_WORKERS = 8
+# The client library writes downloads in small pieces; buffer them so the destination sees few, large writes.
+_DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+
+# Linux FICLONE ioctl request number, which reflinks one file's contents into another on copy-on-write filesystems
+_FICLONE = 0x40049409
+# Hard links fail with these when crossing filesystems, on files the user does not own, or where links are unsupported
+_LINK_FALLBACK_ERRNOS = frozenset((errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP))
 
 def read_fixed_length_cram_file_definition(fh: io.BytesIO) -> Dict[str, Union[int, str]]:
     """
@@ -44,11 +117,12 @@ def read_fixed_length_cram_file_definition(fh: io.BytesIO) -> Dict[str, Union[in
         2.1 Gained end of file markers; compatible with 2.0.
         3.0 Additional compression methods; header and data checksums; improvements for unsorted data.
     """
+    definition = fh.read(26)
     return {
-        'cram': fh.read(4).decode('utf-8'),
-        'major_version': decode_int8(fh),
-        'minor_version': decode_int8(fh),
-        'file_id': fh.read(20).decode('utf-8')
+        'cram': definition[:4].decode('ascii'),
+        'major_version': definition[4],
+        'minor_version': definition[5],
+        'file_id': definition[6:26].decode('utf-8')
     }
 
 def read_cram_container_header(fh: io.BytesIO) -> Dict[str, Any]:
@@ -84,22 +158,32 @@ def read_cram_container_header(fh: io.BytesIO) -> Dict[str, Any]:
     | INT             crc32                      CRC32 hash of the all the preceding bytes in the container.  |
     -----------------------------------------------------------------------------------------------------------
     """
-    return {
-        "length": decode_int32(fh),
-        "reference_sequence_id": decode_itf8(fh),
-        "starting_position": decode_itf8(fh),
-        "alignment_span": decode_itf8(fh),
-        "number_of_records": decode_itf8(fh),
-        "record_counter": decode_ltf8(fh),
-        "bases": decode_ltf8(fh),
-        "number_of_blocks": decode_itf8(fh),
-        "landmark": decode_itf8_array(fh),
-        "crc_hash": fh.read(4)
-    }
+    # Read enough bytes to cover every field up to and including the landmark count, decode from memory, then give
+    # back whatever was over-read so the handle is left at the end of the header.
+    buf = fh.read(_CONTAINER_HEADER_MAX_PREFIX_SIZE)
+    header: Dict[str, Any] = {"length": _INT32.unpack_from(buf)[0]}
+    pos = 4
+    # The scalar fields are decoded in one loop with the decoders inlined, rather than a function call per field.
+    from_bytes = int.from_bytes
+    for name, leading_byte in _CONTAINER_HEADER_VARINT_FIELDS:
+        length, head = leading_byte[buf[pos]]
+        if length == 5 and leading_byte is _ITF8_LEADING_BYTE:
+            header[name] = head | from_bytes(buf[pos + 1:pos + 4], 'big') << 4 | (15 & buf[pos + 4])
+        else:
+            header[name] = head | from_bytes(buf[pos + 1:pos + length], 'big')
+        pos += length
+    number_of_landmarks = header.pop("number_of_landmarks")
+    required = pos + 5 * number_of_landmarks + 4
+    if len(buf) < required:
+        buf += fh.read(required - len(buf))
+    header["landmark"], pos = _decode_itf8_array_at(buf, pos, number_of_landmarks)
+    header["crc_hash"] = buf[pos:pos + 4]
+    fh.seek(pos + len(header["crc_hash"]) - len(buf), io.SEEK_CUR)
+    return header
 
 def decode_int32(fh: io.BytesIO) -> int:
     """A CRAM defined 32-bit signed integer type."""
-    return int.from_bytes(fh.read(4), byteorder='little', signed=True)
+    return _INT32.unpack(fh.read(4))[0]
 
 def decode_int8(fh: io.BytesIO) -> int:
     """
@@ -108,7 +192,7 @@ def decode_int8(fh: io.BytesIO) -> int:
     This data type isn't given a special name like "ITF-8" or "int32" in the spec, and is only used twice in the
     file descriptor as a special case, and as a convenience to construct other data types, like ITF-8 and LTF-8.
     """
-    return int.from_bytes(fh.read(1), byteorder='little', signed=False)
+    return fh.read(1)[0]
 
 def decode_itf8(fh: io.BytesIO) -> int:
     """
@@ -139,32 +223,16 @@ def decode_itf8(fh: io.BytesIO) -> int:
      *      write out [bits 1-8]
     Source: https://github.com/samtools/htsjdk/blob/b24c9521958514c43a121651d1fdb2cdeb77cc0b/src/main/java/htsjdk/samtools/cram/io/ITF8.java#L12  # noqa
     """
-    int1 = decode_int8(fh)
-
-    if (int1 & 128) == 0:
+    int1 = fh.read(1)[0]
+    if int1 < 0x80:
+        # single-byte values are the common case and need no further reads
         return int1
-
-    elif (int1 & 64) == 0:
-        int2 = decode_int8(fh)
-        return ((int1 & 127) << 8) | int2
-
-    elif (int1 & 32) == 0:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        return ((int1 & 63) << 16) | int2 << 8 | int3
-
-    elif (int1 & 16) == 0:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        int4 = decode_int8(fh)
-        return ((int1 & 31) << 24) | int2 << 16 | int3 << 8 | int4
-
-    else:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        int4 = decode_int8(fh)
-        int5 = decode_int8(fh)
-        return ((int1 & 15) << 28) | int2 << 20 | int3 << 12 | int4 << 4 | (15 & int5)
+    length, head = _ITF8_LEADING_BYTE[int1]
+    remaining = fh.read(length - 1)
+    if length == 5:
+        # the last byte only contributes its lowest 4 bits
+        return head | int.from_bytes(remaining[:3], 'big') << 4 | (15 & remaining[3])
+    return head | int.from_bytes(remaining, 'big')
 
 def encode_itf8(num: int) -> bytes:
     """
@@ -195,19 +263,17 @@ def encode_itf8(num: int) -> bytes:
      *      write out [bits 1-8]
     Source: https://github.com/samtools/htsjdk/blob/b24c9521958514c43a121651d1fdb2cdeb77cc0b/src/main/java/htsjdk/samtools/cram/io/ITF8.java#L12  # noqa
     """
-    if num < 2 ** 7:
-        integers = [num]
-    elif num < 2 ** 14:
-        integers = [((num >> 8) | 0x80), (num & 0xFF)]
-    elif num < 2 ** 21:
-        integers = [((num >> 16) | 0xC0), ((num >> 8) & 0xFF), (num & 0xFF)]
-    elif num < 2 ** 28:
-        integers = [((num >> 24) | 0xE0), ((num >> 16) & 0xFF), ((num >> 8) & 0xFF), (num & 0xFF)]
-    elif num < 2 ** 32:
-        integers = [((num >> 28) | 0xF0), ((num >> 20) & 0xFF), ((num >> 12) & 0xFF), ((num >> 4) & 0xFF), (num & 0xFF)]
-    else:
+    if 0 <= num < 128:
+        return _ITF8_ONE_BYTE[num]
+    elif num < 0:
+        raise ValueError('Number is negative.')
+    elif num >= 2 ** 32:
         raise ValueError('Number is too large for an unsigned 32-bit integer.')
-    return bytes(integers)
+    length, prefix = _ITF8_ENCODING[num.bit_length()]
+    if length == 5:
+        # bits 5-8 are written twice: in the fourth byte, and again in the upper nibble of the fifth
+        return ((0xF0 << 24 | num >> 4) << 8 | (num & 0xFF)).to_bytes(5, 'big')
+    return (prefix | num).to_bytes(length, 'big')
 
 def decode_ltf8(fh: io.BytesIO) -> int:
     """
@@ -218,81 +284,10 @@ def decode_ltf8(fh: io.BytesIO) -> int:
 
     Source: https://github.com/samtools/htsjdk/blob/b24c9521958514c43a121651d1fdb2cdeb77cc0b/src/main/java/htsjdk/samtools/cram/io/LTF8.java  # noqa
     """
-    int1 = decode_int8(fh)
-
-    # same as itf8
-    if (int1 & 128) == 0:
-        return int1
-
-    # same as itf8
-    elif (int1 & 64) == 0:
-        int2 = decode_int8(fh)
-        return (int1 & 127) << 8 | int2
-
-    # same as itf8
-    elif (int1 & 32) == 0:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        return (int1 & 63) << 16 | int2 << 8 | int3
-
-    # same as itf8
-    elif (int1 & 16) == 0:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        int4 = decode_int8(fh)
-        return (int1 & 31) << 24 | int2 << 16 | int3 << 8 | int4
-
-    # differs from itf8; doesn't truncate 4 bytes
-    elif (int1 & 8) == 0:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        int4 = decode_int8(fh)
-        int5 = decode_int8(fh)
-        return (int1 & 15) << 32 | (0xFF & int2) << 24 | int3 << 16 | int4 << 8 | int5
-
-    # this is where the number gets too big for itf8
-    elif (int1 & 4) == 0:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        int4 = decode_int8(fh)
-        int5 = decode_int8(fh)
-        int6 = decode_int8(fh)
-        return (int1 & 7) << 40 | (0xFF & int2) << 32 | (0xFF & int3) << 24 | (int4 << 16) | (int5 << 8) | int6
-
-    elif (int1 & 2) == 0:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        int4 = decode_int8(fh)
-        int5 = decode_int8(fh)
-        int6 = decode_int8(fh)
-        int7 = decode_int8(fh)
-        return (int1 & 3) << 48 | (0xFF & int2) << 40 | (0xFF & int3) << 32 | \
-               (0xFF & int4) << 24 | int5 << 16 | int6 << 8 | int7
-
-    # NOTE: int1 is unused here!
-    elif (int1 & 1) == 0:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        int4 = decode_int8(fh)
-        int5 = decode_int8(fh)
-        int6 = decode_int8(fh)
-        int7 = decode_int8(fh)
-        int8 = decode_int8(fh)
-        return (0xFF & int2) << 48 | (0xFF & int3) << 40 | (0xFF & int4) << 32 | \
-               (0xFF & int5) << 24 | int6 << 16 | int7 << 8 | int8
-
-    # NOTE: int1 is also unused here!
-    else:
-        int2 = decode_int8(fh)
-        int3 = decode_int8(fh)
-        int4 = decode_int8(fh)
-        int5 = decode_int8(fh)
-        int6 = decode_int8(fh)
-        int7 = decode_int8(fh)
-        int8 = decode_int8(fh)
-        int9 = decode_int8(fh)
-        return (0xFF & int2) << 56 | (0xFF & int3) << 48 | (0xFF & int4) << 40 | (0xFF & int5) << 32 | \
-               (0xFF & int6) << 24 | int7 << 16 | int8 << 8 | int9
+    # unlike itf8, every byte after the first is used in full; for 8 and 9 byte values the first byte is only a
+    # length marker and carries no value bits
+    length, head = _LTF8_LEADING_BYTE[decode_int8(fh)]
+    return head | int.from_bytes(fh.read(length - 1), 'big')
 
 def encode_ltf8(num: int) -> bytes:
     """
@@ -302,35 +297,11 @@ def encode_ltf8(num: int) -> bytes:
     LTF-8 allocates 1-9 bytes to store integers, and ITF-8 only allocates 1-5 bytes.
     Source: https://github.com/samtools/htsjdk/blob/b24c9521958514c43a121651d1fdb2cdeb77cc0b/src/main/java/htsjdk/samtools/cram/io/LTF8.java  # noqa
     """
-    if num >> 7 == 0:
-        integers = [num]
-    elif num >> 14 == 0:
-        integers = [((num >> 8) | 0x80), num & 0xFF]
-    elif num >> 21 == 0:
-        integers = [((num >> 16) | 0xC0), (num >> 8) & 0xFF, num & 0xFF]
-    elif num >> 28 == 0:
-        integers = [((num >> 24) | 0xE0), (num >> 16) & 0xFF, (num >> 8) & 0xFF, num & 0xFF]
-    elif num >> 35 == 0:
-        # differs from itf8; doesn't truncate 4 bytes
-        integers = [((num >> 32) | 0xF0), (num >> 24) & 0xFF, (num >> 16) & 0xFF, (num >> 8) & 0xFF, num & 0xFF]
-    elif num >> 42 == 0:
-        # this is where the number gets too big for itf8
-        integers = [((num >> 40) | 0xF8), (num >> 32) & 0xFF, (num >> 24) & 0xFF, (num >> 16) & 0xFF,
-                    (num >> 8) & 0xFF, num & 0xFF]
-    elif num >> 49 == 0:
-        integers = [((num >> 48) | 0xFC), (num >> 40) & 0xFF, (num >> 32) & 0xFF, (num >> 24) & 0xFF,
-                    (num >> 16) & 0xFF, (num >> 8) & 0xFF, num & 0xFF]
-    elif num >> 56 == 0:
-        # note the first byte here is constant
-        integers = [0xFE, (num >> 48) & 0xFF, (num >> 40) & 0xFF, (num >> 32) & 0xFF, (num >> 24) & 0xFF,
-                    (num >> 16) & 0xFF, (num >> 8) & 0xFF, num & 0xFF]
-    elif num >> 64 == 0:
-        # note the first byte here is constant
-        integers = [0xFF, (num >> 56) & 0xFF, (num >> 48) & 0xFF, (num >> 40) & 0xFF, (num >> 32) & 0xFF,
-                    (num >> 24) & 0xFF, (num >> 16) & 0xFF, (num >> 8) & 0xFF, num & 0xFF]
-    else:
+    if not 0 <= num < 2 ** 64:
         raise ValueError(f'Number is too large for an unsigned 64-bit integer: {num}')
-    return bytes(integers)
+    # for 8 and 9 byte values the first byte is a constant length marker (0xFE and 0xFF) carrying no value bits
+    length, prefix = _LTF8_ENCODING[num.bit_length()]
+    return (prefix | num).to_bytes(length, 'big')
 
 def decode_itf8_array(handle: io.BytesIO, size: Optional[int] = None):
     """
@@ -342,23 +313,116 @@ def decode_itf8_array(handle: io.BytesIO, size: Optional[int] = None):
     """
     if size is None:
         size = decode_itf8(handle)
-    return [decode_itf8(handle) for _ in range(size)]
+    # each element is at most 5 bytes, so this is guaranteed to hold the whole array; seek back over the excess
+    buf = handle.read(5 * size)
+    values, pos = _decode_itf8_array_at(buf, 0, size)
+    handle.seek(pos - len(buf), io.SEEK_CUR)
+    return values
+
+def _decode_itf8_array_at(buf: bytes, pos: int, size: int) -> Tuple[List[int], int]:
+    """Decode `size` consecutive ITF-8 integers starting at `buf[pos]`, returning them and the position just past."""
+    # This is the innermost loop of header parsing: the ITF-8 decode is inlined and the lookup tables are bound to
+    # locals to avoid a function call and global lookups per element.
+    leading_byte, from_bytes = _ITF8_LEADING_BYTE, int.from_bytes
+    values = [0] * size
+    for i in range(size):
+        length, head = leading_byte[buf[pos]]
+        if length == 1:
+            values[i] = head
+        elif length == 5:
+            values[i] = head | from_bytes(buf[pos + 1:pos + 4], 'big') << 4 | (15 & buf[pos + 4])
+        else:
+            values[i] = head | from_bytes(buf[pos + 1:pos + length], 'big')
+        pos += length
+    return values, pos
+
+def get_crai_indices(crai: Union[str, bytes]) -> List[CramLocation]:
+    """
+    Parse a CRAI index given its raw (gzipped) contents, a local path, or a gs:// or drs:// URL.
 
-def get_crai_indices(crai):
+    Remote indices are downloaded straight into memory rather than written to disk and read back.
+    """
+    if isinstance(crai, (bytes, bytearray)):
+        return get_crai_indices_from_bytes(crai)
+    elif crai.startswith('gs://') or crai.startswith('drs://'):
+        blob = gs_utils._blob_for_url(crai)
+        if blob is None:
+            raise FileNotFoundError(f'No such object: {crai}')
+        return get_crai_indices_from_bytes(blob.download_as_bytes())
+    path = os.path.abspath(crai[len('file://'):] if crai.startswith('file://') else crai)
+    st = os.stat(path)
+    # return a fresh list so callers cannot mutate the cached one
+    return list(_get_local_crai_indices(path, st.st_mtime_ns, st.st_size))
+
+@lru_cache(maxsize=32)
+def _get_local_crai_indices(path: str, mtime_ns: int, size: int) -> Tuple[CramLocation, ...]:
+    """
+    Parse a local CRAI once per process; the modification time and size are part of the key so edits are picked up.
+    """
+    with open(path, "rb") as fh:
+        return tuple(get_crai_indices_from_bytes(fh.read()))
+
+def get_crai_indices_from_bytes(data: bytes) -> List[CramLocation]:
+    """
+    Parse a gzipped CRAI index held in memory.
+
+    CRAI files are small enough to decompress in a single call, which is much faster than streaming them line by line.
+    """
     crai_indices = []
-    with open(crai, "rb") as fh:
-        with gzip.GzipFile(fileobj=fh) as gzip_reader:
-            with io.TextIOWrapper(gzip_reader, encoding='ascii') as reader:
-                for line in reader:
-                    crai_indices.append(CramLocation(*[int(d) for d in line.split("\t")]))
+    for line in gzip.decompress(data).splitlines():
+        crai_indices.append(CramLocation(*[int(d) for d in line.split(b"\t")]))
     return crai_indices
 
-def download_full_gs(gs_path: str, output_filename: str = None) -> str:
-    # TODO: use gs_chunked_io instead
+def _assert_crc32c(blob: gscio.reader.Blob, checksum: google_crc32c.Checksum, filename: str) -> None:
+    """Raise ValueError if `checksum`, computed over `filename`, does not match the CRC32C GCS reports for `blob`."""
+    if blob.crc32c is None:
+        log.warning(f'No CRC32C is available for "{blob.name}"; {filename} was not verified.')
+        return
+    crc32c = base64.b64encode(checksum.digest()).decode('utf-8')
+    if crc32c != blob.crc32c:
+        raise ValueError(f'CRC32C mismatch for "{blob.name}" downloaded to {filename}: '
+                         f'expected {blob.crc32c}, got {crc32c}.')
+
+def _file_crc32c(filename: str) -> google_crc32c.Checksum:
+    checksum = google_crc32c.Checksum()
+    with open(filename, 'rb') as fh:
+        for data in iter(lambda: fh.read(_DOWNLOAD_BUFFER_SIZE), b''):
+            checksum.update(data)
+    return checksum
+
+def download_full_gs(gs_path: str, output_filename: str = None, blob: Optional[gscio.reader.Blob] = None) -> str:
+    """
+    Download an entire blob to a local file.
+
+    Blobs of at least `_PARALLEL_DOWNLOAD_THRESHOLD` bytes are fetched as concurrent ranged reads with gs_chunked_io,
+    which is much faster than a single streamed request. Callers that have already resolved `gs_path` may pass `blob`
+    to save a second metadata request.
+    """
     bucket_name, key_name = gs_path[len('gs://'):].split('/', 1)
     output_filename = output_filename if output_filename else os.path.abspath(os.path.basename(key_name))
-    blob = gs_utils._blob_for_url(gs_path)
-    blob.download_to_filename(output_filename)
+    blob = blob or gs_utils._blob_for_url(gs_path)
+    if blob is None:
+        raise FileNotFoundError(f'No such object: {gs_path}')
+    if blob.size < _PARALLEL_DOWNLOAD_THRESHOLD:
+        with open(output_filename, 'wb', buffering=_DOWNLOAD_BUFFER_SIZE) as fh:
+            blob.download_to_file(fh)
+    else:
+        with ThreadPoolExecutor(max_workers=_PARALLEL_DOWNLOAD_WORKERS) as e:
+            async_queue = async_collections.AsyncQueue(e, _PARALLEL_DOWNLOAD_WORKERS)
+            # gs_chunked_io fetches chunks with checksum=None, so verify the whole object while writing it out
+            checksum = google_crc32c.Checksum()
+            with gscio.Reader(blob, async_queue=async_queue) as reader, open(output_filename, 'wb') as fh:
+                while True:
+                    data = reader.read(reader.chunk_size)
+                    if not data:
+                        break
+                    checksum.update(data)
+                    fh.write(data)
+        try:
+            _assert_crc32c(blob, checksum, output_filename)
+        except ValueError:
+            os.unlink(output_filename)
+            raise
     log.debug(f'Entire file "{gs_path}" downloaded to: {output_filename}')
     return output_filename
 
@@ -368,7 +432,8 @@ def format_and_check_cram(cram: str) -> str:
     if ':' in cram:
         raise NotImplementedError(f'Unsupported schema: {cram}')
     cram = os.path.abspath(cram)
-    assert os.path.exists(cram)
+    if not stat.S_ISREG(os.stat(cram).st_mode):
+        raise FileNotFoundError(f'Not a regular file: {cram}')
     return cram
 
 def write_final_file_with_samtools(cram: str,
@@ -376,21 +441,94 @@ def write_final_file_with_samtools(cram: str,
                                    regions: Optional[str],
                                    cram_format: bool,
                                    output: str) -> None:
-    region_args = ' '.join(regions.split(',')) if regions else ''
-    cram_format_arg = '-C' if cram_format else ''
+    cmd = ['samtools', 'view', '--threads', str(cores_available), '-o', output]
+    if cram_format:
+        cmd.append('-C')
+    cmd.append(cram)
     if crai:
-        crai_arg = f'-X {crai}'
-    else:
+        cmd.extend(['-X', crai])
+    elif regions:
         log.warning('No crai file present, this may take a while.')
-        crai_arg = ''
-
-    # we can get away with a simple split on spaces here because there's nothing complicated going on
-    cmd = f'samtools view {cram_format_arg} {cram} {crai_arg} {region_args}'.split()
+    if regions:
+        cmd.extend(region.strip() for region in regions.split(',') if region.strip())
 
     log.info(f'Now running: {cmd}')
-    run(cmd, stdout=open(output, 'w'), check=True)
+    process = run(cmd, check=True, stderr=subprocess.PIPE)
+    if process.stderr:
+        # stderr is captured so failures carry samtools' message; still surface warnings such as unknown regions
+        log.warning(f'samtools: {process.stderr.decode("utf-8", errors="replace").rstrip()}')
     log.debug(f'Output CRAM successfully generated at: {output}')
 
+def _stage_gs(uri: str, output: str) -> None:
+    """
+    Download a gs:// object, or link it from the `XSAMTOOLS_CACHE` directory when that is set.
+
+    Cached copies are keyed on bucket, name, and generation, so an overwritten object is downloaded afresh.
+    """
+    cache_dir = os.environ.get('XSAMTOOLS_CACHE')
+    if not cache_dir:
+        download_full_gs(uri, output_filename=output)
+        return
+    blob = gs_utils._blob_for_url(uri)
+    if blob is None:
+        raise FileNotFoundError(f'No such object: {uri}')
+    key = hashlib.sha256(f'{blob.bucket.name}/{blob.name}/{blob.generation}'.encode('utf-8')).hexdigest()
+    cached = os.path.join(cache_dir, key)
+    if not (os.path.isfile(cached) and os.path.getsize(cached) == blob.size):
+        os.makedirs(cache_dir, exist_ok=True)
+        partial = f'{cached}.{os.getpid()}.partial'
+        try:
+            download_full_gs(uri, output_filename=partial, blob=blob)
+            # entries are reused indefinitely, so check the whole file before admitting it rather than trusting size
+            _assert_crc32c(blob, _file_crc32c(partial), partial)
+            os.replace(partial, cached)
+        except BaseException:
+            # the cache is never pruned, so don't leave a half-written download behind
+            if os.path.exists(partial):
+                os.unlink(partial)
+            raise
+    else:
+        log.debug(f'Using cached copy of "{uri}": {cached}')
+    _stage_local(cached, output)
+
+def _stage_http(uri: str, output: str) -> None:
+    with urlopen(uri) as response, open(output, 'wb') as fh:
+        copyfileobj(response, fh, _STAGE_BUFFER_SIZE)
+
+def _stage_local(path: str, output: str) -> None:
+    if os.path.abspath(path) != os.path.abspath(output):
+        try:
+            os.link(path, output)
+        except OSError as e:
+            if e.errno not in _LINK_FALLBACK_ERRNOS:
+                raise
+            _copy_local(path, output)
+
+def _copy_local(path: str, output: str) -> None:
+    """
+    Copy a file for staging when it cannot be hard linked.
+
+    A reflink shares the source's extents on copy-on-write filesystems (btrfs, XFS), making the copy metadata-only;
+    elsewhere `shutil.copyfile` copies in the kernel with sendfile.
+    """
+    with open(path, 'rb') as src, open(output, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    copyfile(path, output)
+
+def _stage_file(uri: str, output: str) -> None:
+    _stage_local(uri[len('file://'):], output)
+
+_STAGE_HANDLERS = {
+    'gs': _stage_gs,
+    'file': _stage_file,
+    'http': _stage_http,
+    'https': _stage_http,
+}
+
 def stage(uri: str, output: str) -> None:
     """
     Make a file available locally for samtools to use.
@@ -398,19 +536,23 @@ def stage(uri: str, output: str) -> None:
     This also allows the file to be placed in the same folder as associated
     files, like cram and crai, which samtools can be picky about.
     """
-    if uri.startswith('gs://'):
-        download_full_gs(uri, output_filename=output)
-    elif uri.startswith('file://'):
-        if os.path.abspath(uri[len('file://'):]) != os.path.abspath(output):
-            os.link(uri[len('file://'):], output)
-    elif uri.startswith('http://') or uri.startswith('https://'):
-        urlretrieve(uri, output)
-    elif ':' not in uri:
-        if os.path.abspath(uri) != os.path.abspath(output):
-            os.link(uri, output)
+    scheme, sep, _ = uri.partition('://')
+    if not sep and ':' not in uri:
+        _stage_local(uri, output)
+    elif scheme in _STAGE_HANDLERS:
+        _STAGE_HANDLERS[scheme](uri, output)
     else:
         raise NotImplementedError(f'Unsupported format: {uri}')
 
+def _local_path(uri: str) -> Optional[str]:
+    """
+    Return the local filesystem path for `uri`, or None if it must be staged first.
+    """
+    path = uri[len('file://'):] if uri.startswith('file://') else uri
+    if ':' in path:
+        return None
+    return os.path.abspath(path)
+
 def timestamped_filename(cram_format: bool) -> str:
     time_stamp = datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")
     extension = 'cram' if cram_format else 'sam'
@@ -427,14 +569,35 @@ def view(cram: str,
     assert ':' not in output, f'Unsupported schema for output: "{output}".\n' \
                               f'Only local file outputs are currently supported.'
 
-    with TemporaryDirectory() as staging_dir:
+    local_cram = _local_path(cram)
+    local_crai = _local_path(crai) if crai else None
+    if local_cram and (local_crai or not crai):
+        # samtools can read local inputs in place; the index is passed explicitly, so it need not sit beside the cram
+        write_final_file_with_samtools(local_cram, local_crai, regions, cram_format, output)
+        return output
+
+    if not regions and (cram.startswith('gs://') or cram.startswith('drs://')):
+        # A full view reads the cram front to back and never uses the index, so stream the blob to samtools through a
+        # FIFO instead of downloading it first; download and decoding then overlap and nothing is written to disk.
+        with ProcessPoolExecutor(max_workers=1) as e:
+            reader = pipes.BlobReaderProcess(cram, e)
+            try:
+                write_final_file_with_samtools(reader.filepath, None, regions, cram_format, output)
+            finally:
+                reader.close()
+        return output
+
+    # staged crams can be very large; let deployments point staging at a big local disk rather than a tmpfs /tmp
+    with TemporaryDirectory(dir=os.environ.get('XSAMTOOLS_STAGING_DIR') or None) as staging_dir:
         staged_cram = os.path.join(staging_dir, 'tmp.cram')
-        stage(uri=cram, output=staged_cram)
-        if crai:
-            staged_crai = os.path.join(staging_dir, 'tmp.crai')
-            stage(uri=crai, output=staged_crai)
-        else:
-            staged_crai = None
+        staged_crai = os.path.join(staging_dir, 'tmp.crai') if crai else None
+        # the crai is small and latency bound, so fetch it alongside the cram rather than after it
+        with ThreadPoolExecutor(max_workers=2) as e:
+            futures = [e.submit(stage, uri=cram, output=staged_cram)]
+            if crai:
+                futures.append(e.submit(stage, uri=crai, output=staged_crai))
+            for f in futures:
+                f.result()
 
         write_final_file_with_samtools(staged_cram, staged_crai, regions, cram_format, output)
 
@@ -1,16 +1,31 @@
 import io
+import os
 from uuid import uuid4
+from functools import lru_cache
 from typing import Sequence, Optional
 
 import google.cloud.exceptions
+import google.cloud.storage
 import gs_chunked_io as gscio
 from terra_notebook_utils import gs, drs, WORKSPACE_GOOGLE_PROJECT
 
 
+@lru_cache(maxsize=1)
+def _client_for_process(pid: int) -> google.cloud.storage.Client:
+    return gs.get_client()
+
+def _get_client() -> google.cloud.storage.Client:
+    """
+    Return a storage client shared across calls, saving the credential refresh that `gs.get_client` does every time.
+
+    Clients hold open connections that must not be shared with forked workers, so each process builds its own.
+    """
+    return _client_for_process(os.getpid())
+
 def _blob_for_url(url: str) -> Optional[gscio.reader.Blob]:
     if url.startswith("gs://"):
         bucket_name, key = url[5:].split("/", 1)
-        client = gs.get_client()
+        client = _get_client()
         bucket = client.bucket(bucket_name)
     elif url.startswith("drs://"):
         client, info = drs.resolve_drs_for_gs_storage(url)
@@ -33,7 +48,7 @@ def _read_access(url: str) -> bool:
         return False
 
 def _write_access(bucket_name: str) -> bool:
-    blob = gs.get_client().bucket(bucket_name).blob(f"verify-access-{uuid4()}")
+    blob = _get_client().bucket(bucket_name).blob(f"verify-access-{uuid4()}")
     try:
         blob.upload_from_file(io.BytesIO(b""))
     except (google.cloud.exceptions.NotFound, google.cloud.exceptions.Forbidden):
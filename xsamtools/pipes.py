@@ -12,7 +12,6 @@ from typing import Any, Tuple, Dict, IO, BinaryIO, Optional
 
 import gs_chunked_io as gscio
 from gs_chunked_io import async_collections
-from terra_notebook_utils import gs
 
 from xsamtools import gs_utils
 
@@ -173,7 +172,7 @@ class BlobWriterProcess(FIFOPipeProcess):
                  filepath=f"{self.filepath}")
 
     def run(self, fh: IO):
-        bucket = gs.get_client().bucket(self.bucket_name)
+        bucket = gs_utils._get_client().bucket(self.bucket_name)
         with ThreadPoolExecutor(max_workers=1) as e:
             async_set = async_collections.AsyncSet(e, 1)
             with gscio.Writer(self.key, bucket, async_set=async_set) as blob_writer: